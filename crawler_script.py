@@ -1,15 +1,26 @@
 # crawler_script.py
 import asyncio
 import csv
+import hashlib
+import io
+import itertools
 import json
 import os
 import re
+import shutil
 import time
+import zipfile
+from collections import defaultdict
+from functools import lru_cache
 from urllib.parse import urljoin, urlparse, urlunparse
 
 from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
-import pandas as pd
-from collections import defaultdict, deque
+from PIL import Image
+
+try:
+    import orjson
+except ImportError:  # fall back to stdlib json
+    orjson = None
 
 # -------------------------
 # Config / Globals
@@ -28,12 +39,22 @@ OUTPUT_CSV_FORM = os.path.join(OUTPUT_DIR, "form_tracking_map.csv")
 OUTPUT_JSON = os.path.join(OUTPUT_DIR, "cta_form_tracking_map.json")
 OUTPUT_EXCEL = os.path.join(OUTPUT_DIR, "cta_sdr_export.xlsx")
 OUTPUT_FLOWS = os.path.join(OUTPUT_DIR, "user_flows.xlsx")
+CSV_WRITE_BUFFER = 1 << 20     # 1 MiB, so writerows doesn't hit the disk per row
 
 # Crawl controls
 MAX_PAGES = 10             # absolute pages to crawl
 PAGE_NAV_TIMEOUT = 30_000      # ms for page.goto
 PAGE_WAIT_AFTER_SCROLL = 1.0   # seconds
 HEADLESS = True                # run browser headless or not
+CRAWL_WORKERS = 8              # concurrent pages (one browser context each)
+PAGES_PER_CTX = 20             # recycle a worker's browser context after this many pages
+VIEWPORT = {"width": 1366, "height": 900}
+# URL patterns Chromium refuses to load while crawling (video/audio, web app manifests);
+# image/font/stylesheet are kept so screenshot crops look like the page
+BLOCKED_URL_PATTERNS = [
+    "*.mp4", "*.webm", "*.ogv", "*.mov", "*.avi", "*.m3u8", "*.mp3", "*.wav",
+    "*.webmanifest", "*/manifest.json",
+]
 
 # Flow generation limits
 MAX_FLOW_DEPTH = 5
@@ -54,6 +75,15 @@ site_graph = defaultdict(set)   # page -> set(links)
 all_ctas = []
 all_forms = []
 visited = set()
+enqueued = set()                # every URL ever pushed onto the crawl queue
+crawl_order = {}                # page -> position in which it was taken off the queue
+page_links = {}                 # page -> all normalized links found on it (document order)
+# screenshot filename numbers; safe to share between concurrent workers
+_cta_counter = itertools.count()
+_form_counter = itertools.count()
+# element signature -> (local, public) screenshot already written for it
+_cta_sig_to_url = {}
+_form_sig_to_url = {}
 
 # Ensure folders exist
 os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -62,11 +92,27 @@ os.makedirs(PUBLIC_SCREENSHOT_DIR, exist_ok=True)
 
 # Regex to ignore mailto/tel/javascript etc.
 INVALID_SCHEMES = re.compile(r'^(mailto:|tel:|javascript:|#)', re.I)
+# Characters not allowed in screenshot filenames
+_SAFE_RE = re.compile(r'[^A-Za-z0-9\-_\.]')
+# Links to static assets/downloads: never pages with CTAs or forms, so don't crawl them
+_DENY_EXT = re.compile(
+    r'\.(jpg|jpeg|png|gif|svg|webp|pdf|zip|rar|gz|mp3|mp4|avi|mov|doc|docx|xls|xlsx|css|js|ico|woff2?|ttf)$',
+    re.I
+)
+# Runs of slashes inside a URL path
+_DOUBLE_SLASH = re.compile(r'\/\/+')
 
 
 # -------------------------
 # Helpers
 # -------------------------
+@lru_cache(maxsize=1024)
+def base_origin(base):
+    """scheme://netloc of a page URL (cached: every link on a page shares the same base)."""
+    parsed = urlparse(base)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
 def normalize_url(base, link):
     """
     Normalize a found link: join, remove fragment, strip trailing slash (except root).
@@ -78,13 +124,21 @@ def normalize_url(base, link):
     # ignore invalid schemes
     if INVALID_SCHEMES.match(link):
         return None
-
-    # Make absolute
-    try:
-        absolute = urljoin(base, link)
-    except Exception:
+    # ignore asset links before paying for join/parse; only the path counts, not ?query/#fragment
+    if _DENY_EXT.search(link.split('?', 1)[0].split('#', 1)[0]):
         return None
 
+    # Make absolute; root-relative links without dot segments only need the base origin.
+    # Links with tab/CR/LF go through urljoin: urlparse drops those characters, so "/\t/x" is really "//x".
+    if (link.startswith("/") and not link.startswith("//") and "/." not in link
+            and "\t" not in link and "\r" not in link and "\n" not in link):
+        absolute = base_origin(base) + link
+    else:
+        try:
+            absolute = urljoin(base, link)
+        except Exception:
+            return None
+
     parsed = urlparse(absolute)
 
     # Only http(s)
@@ -104,7 +158,7 @@ def normalize_url(base, link):
     # Normalise query: optional -> keep queries but could remove in future
     path = parsed.path or "/"
     # remove duplicate slashes
-    path = re.sub(r'\/\/+', '/', path)
+    path = _DOUBLE_SLASH.sub('/', path)
 
     # strip trailing slash for non-root
     if path != "/" and path.endswith("/"):
@@ -117,7 +171,66 @@ def normalize_url(base, link):
 
 def safe_filename(s: str) -> str:
     """Make a simple safe filename from URL"""
-    return re.sub(r'[^A-Za-z0-9\-_\.]', '_', s)[:200]
+    return _SAFE_RE.sub('_', s)[:200]
+
+
+def crop_box(full, el, min_size):
+    """Build a (left, top, right, bottom) crop box for an element, clamped to the full-page image."""
+    left = min(max(int(el.get("x", 0) or 0), 0), full.width)
+    top = min(max(int(el.get("y", 0) or 0), 0), full.height)
+    right = min(left + max(int(el.get("width", min_size) or min_size), min_size), full.width)
+    bottom = min(top + max(int(el.get("height", min_size) or min_size), min_size), full.height)
+    return left, top, right, bottom
+
+
+def save_crop(full, box, local_path, public_path):
+    """Crop one element out of the full-page image and write it to both screenshot dirs."""
+    if box[2] <= box[0] or box[3] <= box[1]:
+        raise ValueError(f"empty crop box {box}")
+    # compress_level=1: much faster encode for a slightly bigger file
+    full.crop(box).save(local_path, "PNG", optimize=False, compress_level=1)
+    link_or_copy(local_path, public_path)
+
+
+async def save_crops(full, jobs):
+    """Run save_crop for every (box, local_path, public_path) job in worker threads; returns an ok-flag per job."""
+    results = await asyncio.gather(
+        *(asyncio.to_thread(save_crop, full, box, local_path, public_path) for box, local_path, public_path in jobs),
+        return_exceptions=True
+    )
+    return [not isinstance(result, BaseException) for result in results]
+
+
+async def save_page_crops(full, jobs, sig_to_url):
+    """
+    Save one page's (signature, (box, local, public)) crop jobs.
+    Failed signatures are dropped from sig_to_url so a later page can retry; returns the failed local paths.
+    """
+    saved = await save_crops(full, [job for _, job in jobs])
+    failed = set()
+    for (sig, (_, local_path, _)), ok in zip(jobs, saved):
+        if not ok:
+            sig_to_url.pop(sig, None)
+            failed.add(local_path)
+    return failed
+
+
+def element_signature(*parts):
+    """Digest identifying a CTA/form by its attributes, so repeats across pages share one screenshot."""
+    return hashlib.blake2b("|".join(str(part) for part in parts).encode("utf-8"), digest_size=16).digest()
+
+
+def link_or_copy(src, dst):
+    """Hardlink dst to src (same bytes, one inode); fall back to a copy across devices or where links aren't supported."""
+    try:
+        try:
+            os.link(src, dst)
+        except FileExistsError:
+            # overwrite left-overs from a previous crawl
+            os.remove(dst)
+            os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
 
 
 # -------------------------
@@ -150,62 +263,85 @@ async def accept_cookies(page):
         pass
 
 
-async def extract_ctas(page, current_url):
-    script = """
-    () => {
-        return Array.from(
+# One round-trip per page: CTAs, forms and raw links in a single evaluate
+PAGE_SCRIPT = """
+() => {
+    // document coordinates, so they line up with the full-page screenshot
+    const box = el => {
+        const rect = el.getBoundingClientRect();
+        return {
+            x: (rect.x || 0) + window.scrollX, y: (rect.y || 0) + window.scrollY,
+            width: rect.width || 0, height: rect.height || 0
+        };
+    };
+    return {
+        ctas: Array.from(
             document.querySelectorAll("a,button,[role='button'],input[type='submit'],input[type='button']")
-        ).map(el => {
-            const rect = el.getBoundingClientRect();
-            return {
-                tag: el.tagName.toLowerCase(),
-                text: (el.innerText || el.textContent || "").trim(),
-                href: el.getAttribute("href") || "",
-                id: el.id || "",
-                class: el.className || "",
-                x: rect.x || 0, y: rect.y || 0, width: rect.width || 0, height: rect.height || 0
-            };
-        });
-    }
-    """
-    try:
-        elements = await page.evaluate(script)
-    except Exception:
-        elements = []
+        ).map(el => ({
+            tag: el.tagName.toLowerCase(),
+            text: (el.innerText || el.textContent || "").trim(),
+            href: el.getAttribute("href") || "",
+            id: el.id || "",
+            class: el.className || "",
+            ...box(el)
+        })),
+        forms: Array.from(document.querySelectorAll("form")).map(form => ({
+            form_id: form.id || "",
+            form_class: form.className || "",
+            form_name: form.getAttribute("name") || "",
+            method: form.getAttribute("method") || "GET",
+            action: form.getAttribute("action") || "",
+            ...box(form),
+            inputs: Array.from(form.querySelectorAll("input, select, textarea")).map(inp => ({
+                type: inp.type || "text",
+                name: inp.name || "",
+                placeholder: inp.placeholder || "",
+                id: inp.id || "",
+                class: inp.className || ""
+            })),
+            submit_buttons: Array.from(form.querySelectorAll("button[type='submit'], input[type='submit']")).map(btn => ({
+                text: btn.innerText || btn.value || "",
+                id: btn.id || "",
+                class: btn.className || ""
+            }))
+        })),
+        links: Array.from(document.querySelectorAll("a[href]")).map(a => a.getAttribute("href"))
+    };
+}
+"""
+
 
+async def extract_ctas(elements, current_url, full):
+    """Turn the CTA entries from PAGE_SCRIPT into export rows, cropping a screenshot for each."""
+    url_stem = safe_filename(current_url)
+    page_name = urlparse(current_url).path.strip("/") or "home"
     ctas = []
-    for i, el in enumerate(elements):
+    jobs = []  # (signature, (box, local, public))
+    for el in elements:
         local_screenshot = ""
         public_screenshot = ""
         try:
             # only screenshot visible-ish elements
-            if (el.get("width", 0) or 0) > 6 and (el.get("height", 0) or 0) > 6:
-                filename = f"cta_{len(all_ctas) + i}_{safe_filename(current_url)}.png"
-                local_screenshot = os.path.join(LOCAL_SCREENSHOT_DIR, filename)
-                public_screenshot = os.path.join(PUBLIC_SCREENSHOT_DIR, filename)
-
-                # clip values must be ints and non-negative
-                clip = {
-                    "x": max(int(el.get("x", 0) or 0), 0),
-                    "y": max(int(el.get("y", 0) or 0), 0),
-                    "width": max(int(el.get("width", 10) or 10), 10),
-                    "height": max(int(el.get("height", 10) or 10), 10)
-                }
-                try:
-                    # take screenshots into both locations (overwrite is fine)
-                    await page.screenshot(path=local_screenshot, clip=clip)
-                    await page.screenshot(path=public_screenshot, clip=clip)
-                except Exception:
-                    # if screenshot fails, clear names
-                    local_screenshot = ""
-                    public_screenshot = ""
+            if full is not None and (el.get("width", 0) or 0) > 6 and (el.get("height", 0) or 0) > 6:
+                sig = element_signature(el.get("tag"), el.get("text"), el.get("href"), el.get("id"), el.get("class"))
+                if sig in _cta_sig_to_url:
+                    # same CTA already captured (shared nav/footer): reuse its screenshot
+                    local_screenshot, public_screenshot = _cta_sig_to_url[sig]
+                else:
+                    filename = f"cta_{next(_cta_counter)}_{url_stem}.png"
+                    local_screenshot = os.path.join(LOCAL_SCREENSHOT_DIR, filename)
+                    public_screenshot = os.path.join(PUBLIC_SCREENSHOT_DIR, filename)
+
+                    # crop out of the page capture into both locations (overwrite is fine)
+                    jobs.append((sig, (crop_box(full, el, 10), local_screenshot, public_screenshot)))
+                    _cta_sig_to_url[sig] = (local_screenshot, public_screenshot)
         except Exception:
             local_screenshot = ""
             public_screenshot = ""
 
         ctas.append({
             "page_url": current_url,
-            "page_name": urlparse(current_url).path.strip("/") or "home",
+            "page_name": page_name,
             "element_type": el.get("tag", ""),
             "text": el.get("text", ""),
             "id_or_class": el.get("id") or el.get("class") or "",
@@ -214,85 +350,237 @@ async def extract_ctas(page, current_url):
             "screenshot_local": local_screenshot,
             "screenshot_url": f"/screenshots/{os.path.basename(public_screenshot)}" if public_screenshot else ""
         })
-    return ctas
 
+    # encode + write this page's crops off the event loop, all at once
+    failed = await save_page_crops(full, jobs, _cta_sig_to_url)
+    for row in ctas:
+        if row["screenshot_local"] in failed:
+            # if screenshot fails, clear names
+            row["screenshot_local"] = ""
+            row["screenshot_url"] = ""
+    return ctas
 
-async def extract_forms(page, current_url):
-    script = """
-    () => {
-        return Array.from(document.querySelectorAll("form")).map(form => {
-            const rect = form.getBoundingClientRect();
-            return {
-                form_id: form.id || "",
-                form_class: form.className || "",
-                form_name: form.getAttribute("name") || "",
-                method: form.getAttribute("method") || "GET",
-                action: form.getAttribute("action") || "",
-                x: rect.x || 0, y: rect.y || 0, width: rect.width || 0, height: rect.height || 0,
-                inputs: Array.from(form.querySelectorAll("input, select, textarea")).map(inp => ({
-                    type: inp.type || "text",
-                    name: inp.name || "",
-                    placeholder: inp.placeholder || "",
-                    id: inp.id || "",
-                    class: inp.className || ""
-                })),
-                submit_buttons: Array.from(form.querySelectorAll("button[type='submit'], input[type='submit']")).map(btn => ({
-                    text: btn.innerText || btn.value || "",
-                    id: btn.id || "",
-                    class: btn.className || ""
-                }))
-            };
-        });
-    }
-    """
-    try:
-        forms = await page.evaluate(script)
-    except Exception:
-        forms = []
 
+async def extract_forms(forms, current_url, full):
+    """Turn the form entries from PAGE_SCRIPT into export rows, cropping a screenshot for each."""
+    url_stem = safe_filename(current_url)
+    page_name = urlparse(current_url).path.strip("/") or "home"
     form_data = []
-    for i, form in enumerate(forms):
+    jobs = []  # (signature, (box, local, public))
+    for form in forms:
         local_screenshot = ""
         public_screenshot = ""
+        inputs = json.dumps(form.get("inputs", []), ensure_ascii=False)
         try:
-            if (form.get("width", 0) or 0) > 50 and (form.get("height", 0) or 0) > 50:
-                filename = f"form_{len(all_forms) + i}_{safe_filename(current_url)}.png"
-                local_screenshot = os.path.join(LOCAL_SCREENSHOT_DIR, filename)
-                public_screenshot = os.path.join(PUBLIC_SCREENSHOT_DIR, filename)
-
-                clip = {
-                    "x": max(int(form.get("x", 0) or 0), 0),
-                    "y": max(int(form.get("y", 0) or 0), 0),
-                    "width": max(int(form.get("width", 50) or 50), 50),
-                    "height": max(int(form.get("height", 50) or 50), 50)
-                }
-                try:
-                    await page.screenshot(path=local_screenshot, clip=clip)
-                    await page.screenshot(path=public_screenshot, clip=clip)
-                except Exception:
-                    local_screenshot = ""
-                    public_screenshot = ""
+            if full is not None and (form.get("width", 0) or 0) > 50 and (form.get("height", 0) or 0) > 50:
+                sig = element_signature(
+                    form.get("form_id"), form.get("form_class"), form.get("form_name"),
+                    form.get("method"), form.get("action"), inputs
+                )
+                if sig in _form_sig_to_url:
+                    local_screenshot, public_screenshot = _form_sig_to_url[sig]
+                else:
+                    filename = f"form_{next(_form_counter)}_{url_stem}.png"
+                    local_screenshot = os.path.join(LOCAL_SCREENSHOT_DIR, filename)
+                    public_screenshot = os.path.join(PUBLIC_SCREENSHOT_DIR, filename)
+
+                    jobs.append((sig, (crop_box(full, form, 50), local_screenshot, public_screenshot)))
+                    _form_sig_to_url[sig] = (local_screenshot, public_screenshot)
         except Exception:
             local_screenshot = ""
             public_screenshot = ""
 
         form_data.append({
             "page_url": current_url,
-            "page_name": urlparse(current_url).path.strip("/") or "home",
+            "page_name": page_name,
             "form_id_or_class": form.get("form_id") or form.get("form_class") or "",
             "method": form.get("method", "GET"),
             "action": form.get("action") or "",
-            "inputs": json.dumps(form.get("inputs", []), ensure_ascii=False),
+            "inputs": inputs,
             "submit_buttons": json.dumps(form.get("submit_buttons", []), ensure_ascii=False),
             "form_screenshot_local": local_screenshot,
             "form_screenshot_url": f"/screenshots/{os.path.basename(public_screenshot)}" if public_screenshot else ""
         })
+
+    failed = await save_page_crops(full, jobs, _form_sig_to_url)
+    for row in form_data:
+        if row["form_screenshot_local"] in failed:
+            row["form_screenshot_local"] = ""
+            row["form_screenshot_url"] = ""
     return form_data
 
 
 # -------------------------
 # Crawl (iterative BFS-like queue, but you can treat as DFS by using stack)
 # -------------------------
+async def new_crawl_page(browser):
+    """
+    Fresh browser context + page for a worker, with BLOCKED_URL_PATTERNS blocked.
+    Blocking goes through CDP Network.setBlockedURLs rather than page/context.route:
+    any Playwright route disables the HTTP cache, and a site's pages share most of their CSS/JS/images.
+    """
+    context = await browser.new_context(viewport=VIEWPORT, java_script_enabled=True)
+    page = await context.new_page()
+    try:
+        cdp = await context.new_cdp_session(page)
+        await cdp.send("Network.enable")
+        await cdp.send("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+    except Exception as e:
+        # crawl unblocked rather than not at all
+        print(f"⚠ Could not set blocked URLs: {e}")
+    return context, page
+
+
+async def crawl_worker(browser, queue, results, max_pages):
+    """
+    Pull (url, depth) entries off the shared queue until cancelled.
+    Check-then-insert on `visited` is safe without a lock: there is no await in between.
+    Each worker keeps one context/page and recycles it every PAGES_PER_CTX pages.
+    """
+    context = None
+    page = None
+    pages_in_context = 0
+    try:
+        while True:
+            url, depth = await queue.get()
+            try:
+                if url in visited or len(visited) >= max_pages:
+                    continue
+                visited.add(url)
+                crawl_order[url] = len(crawl_order)
+
+                # ✅ Update UI crawl status BEFORE loading page
+                crawl_status["current_url"] = url
+                crawl_status["pages_crawled"] = len(visited)
+
+                print(f"[{len(visited)}/{max_pages}] Crawling: {url} (depth={depth})")
+
+                # start over with a clean context so cookies/storage don't pile up
+                if context is None or pages_in_context >= PAGES_PER_CTX:
+                    if context is not None:
+                        await context.close()
+                    context, page = await new_crawl_page(browser)
+                    pages_in_context = 0
+                pages_in_context += 1
+
+                await crawl_page(page, url, depth, queue, results, max_pages)
+            except Exception as e:
+                print(f"⚠ Unexpected error on {url}: {e}")
+                # don't reuse a context that may be in a broken state
+                pages_in_context = PAGES_PER_CTX
+            finally:
+                queue.task_done()
+    finally:
+        if context is not None:
+            try:
+                await context.close()
+            except Exception:
+                pass
+
+
+async def crawl_page(page, url, depth, queue, results, max_pages):
+    """
+    Load a single page, enqueue the same-domain links it points to and hand its
+    capture + PAGE_SCRIPT data to the processor via `results`.
+    """
+    # navigate with timeout and wait for DOM
+    try:
+        await page.goto(url, wait_until="domcontentloaded", timeout=PAGE_NAV_TIMEOUT)
+    except PlaywrightTimeoutError:
+        print(f"⚠ Timeout loading {url} (continuing)")
+        # still try to continue extracting minimal content
+    except Exception as e:
+        print(f"⚠ Error navigating to {url}: {e}")
+
+    # try cookie accept
+    await accept_cookies(page)
+
+    # scroll to bottom to allow lazy load
+    try:
+        await page.evaluate("window.scrollTo(0, document.body.scrollHeight);")
+        await asyncio.sleep(PAGE_WAIT_AFTER_SCROLL)
+    except Exception:
+        pass
+
+    # CTAs, forms and links in one evaluate
+    try:
+        data = await page.evaluate(PAGE_SCRIPT)
+    except Exception as e:
+        print(f"⚠ Error evaluating {url}: {e}")
+        data = {}
+
+    # one full-page capture per page; the processor crops elements out of it
+    png = None
+    try:
+        png = await page.screenshot(full_page=True)
+    except Exception as e:
+        print(f"⚠ Error capturing {url}: {e}")
+
+    # normalize links; dict.fromkeys drops repeats (nav/footer) but keeps document order
+    raw_links = dict.fromkeys(data.get("links") or [])
+    links = dict.fromkeys(filter(None, (normalize_url(url, raw) for raw in raw_links)))
+
+    # keep every link; site_graph is built from these once the crawl is done
+    page_links[url] = links
+    for link in links:
+        if len(enqueued) >= max_pages:
+            break
+        if link not in enqueued:
+            queue.put_nowait((link, depth + 1))
+            enqueued.add(link)
+
+    # cropping/row building happens in process_pages while this worker moves on
+    await results.put((url, png, data))
+
+
+def decode_capture(png):
+    """Decode a full-page PNG capture into an RGB image for cropping."""
+    return Image.open(io.BytesIO(png)).convert("RGB")
+
+
+async def process_pages(results):
+    """
+    Consume (url, png, data) entries from the crawl workers until a None sentinel:
+    decode the capture off the event loop, crop CTA/form screenshots and collect the rows.
+    """
+    while True:
+        item = await results.get()
+        if item is None:
+            return
+        url, png, data = item
+
+        full = None
+        if png:
+            try:
+                full = await asyncio.to_thread(decode_capture, png)
+            except Exception as e:
+                print(f"⚠ Error decoding capture of {url}: {e}")
+
+        # extract CTAs & forms on this page
+        try:
+            ctas = await extract_ctas(data.get("ctas") or [], url, full)
+            forms = await extract_forms(data.get("forms") or [], url, full)
+            all_ctas.extend(ctas)
+            all_forms.extend(forms)
+        except Exception as e:
+            print(f"⚠ Error extracting on {url}: {e}")
+
+        # update status after extracting
+        crawl_status["pages_crawled"] = len(visited)
+
+
+def build_site_graph():
+    """
+    Rebuild site_graph from page_links using the sequential-crawl rule: keep p -> q only if
+    q was crawled after p or never crawled. Workers finish pages in arbitrary order, so
+    filtering against the live `visited` set would make the graph (and flows) timing-dependent.
+    """
+    site_graph.clear()
+    for url, links in page_links.items():
+        order = crawl_order[url]
+        site_graph[url] = {link for link in links if crawl_order.get(link, order + 1) > order}
+
+
 async def crawl_site(start_url, max_pages=MAX_PAGES, headless=HEADLESS):
     """
     Main crawling function. Uses a queue to avoid recursion and updates global data stores.
@@ -305,6 +593,14 @@ async def crawl_site(start_url, max_pages=MAX_PAGES, headless=HEADLESS):
     all_ctas.clear()
     all_forms.clear()
     visited.clear()
+    enqueued.clear()
+    crawl_order.clear()
+    page_links.clear()
+    global _cta_counter, _form_counter
+    _cta_counter = itertools.count()
+    _form_counter = itertools.count()
+    _cta_sig_to_url.clear()
+    _form_sig_to_url.clear()
 
     crawl_status["running"] = True
     crawl_status["completed"] = False
@@ -314,7 +610,7 @@ async def crawl_site(start_url, max_pages=MAX_PAGES, headless=HEADLESS):
     crawl_status["total"] = max_pages
 
     # queue entries: (url, depth)
-    queue = deque()
+    queue = asyncio.Queue()
     # Normalize and allow non-www and www versions dynamically
     start_norm = normalize_url(start_url, start_url)
 
@@ -328,79 +624,33 @@ async def crawl_site(start_url, max_pages=MAX_PAGES, headless=HEADLESS):
     global DOMAIN
     DOMAIN = parsed_start.netloc.replace("www.", "")
 
-    queue.append((start_norm, 0))
+    queue.put_nowait((start_norm, 0))
+    enqueued.add(start_norm)
 
     try:
         async with async_playwright() as pw:
             browser = await pw.chromium.launch(headless=headless)
-            page = await browser.new_page()
-
-            while queue and len(visited) < max_pages:
-                url, depth = queue.popleft()
-                if url in visited:
-                    continue
-                visited.add(url)
 
-                # ✅ Update UI crawl status BEFORE loading page
-                crawl_status["current_url"] = url
-                crawl_status["pages_crawled"] = len(visited)
-                # allow UI polling to pick it up
-                await asyncio.sleep(0)
+            # fetched pages wait here for the processor; bounded so captures don't pile up in memory
+            results = asyncio.Queue(maxsize=CRAWL_WORKERS * 2)
+            processor = asyncio.create_task(process_pages(results))
 
-                print(f"[{len(visited)}/{max_pages}] Crawling: {url} (depth={depth})")
+            # K workers share the queue, each with its own browser context
+            workers = [
+                asyncio.create_task(crawl_worker(browser, queue, results, max_pages))
+                for _ in range(CRAWL_WORKERS)
+            ]
+            try:
+                await queue.join()
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
 
-                try:
-                    # navigate with timeout and wait for DOM
-                    try:
-                        await page.goto(url, wait_until="domcontentloaded", timeout=PAGE_NAV_TIMEOUT)
-                    except PlaywrightTimeoutError:
-                        print(f"⚠ Timeout loading {url} (continuing)")
-                        # still try to continue extracting minimal content
-                    except Exception as e:
-                        print(f"⚠ Error navigating to {url}: {e}")
-
-                    # try cookie accept
-                    await accept_cookies(page)
-
-                    # scroll to bottom to allow lazy load
-                    try:
-                        await page.evaluate("window.scrollTo(0, document.body.scrollHeight);")
-                        await asyncio.sleep(PAGE_WAIT_AFTER_SCROLL)
-                    except Exception:
-                        pass
-
-                    # extract CTAs & forms on this page
-                    try:
-                        ctas = await extract_ctas(page, url)
-                        forms = await extract_forms(page, url)
-                        all_ctas.extend(ctas)
-                        all_forms.extend(forms)
-                    except Exception as e:
-                        print(f"⚠ Error extracting on {url}: {e}")
-
-                    # update status after extracting
-                    crawl_status["pages_crawled"] = len(visited)
-                    await asyncio.sleep(0)
-
-                    # find links and normalize
-                    links = []
-                    try:
-                        raw_links = await page.eval_on_selector_all("a[href]", "els => els.map(a => a.getAttribute('href'))")
-                        for raw in raw_links:
-                            full = normalize_url(url, raw)
-                            if full and full not in visited:
-                                links.append(full)
-                    except Exception:
-                        links = []
-
-                    # add to graph and queue (avoid duplicates)
-                    for link in links:
-                        site_graph[url].add(link)
-                        if link not in visited and len(visited) + len(queue) < max_pages:
-                            queue.append((link, depth + 1))
-
-                except Exception as e:
-                    print(f"⚠ Unexpected error on {url}: {e}")
+                # let the processor drain what the workers fetched
+                await results.put(None)
+                await processor
+            finally:
+                processor.cancel()
 
             await browser.close()
 
@@ -408,6 +658,8 @@ async def crawl_site(start_url, max_pages=MAX_PAGES, headless=HEADLESS):
         crawl_status["error"] = str(e)
         print(f"⚠ Fatal error while crawling: {e}")
 
+    build_site_graph()
+
     # mark completed
     crawl_status["running"] = False
     crawl_status["completed"] = True
@@ -419,39 +671,48 @@ async def crawl_site(start_url, max_pages=MAX_PAGES, headless=HEADLESS):
 # -------------------------
 # Flow generation (DFS-limited)
 # -------------------------
-def generate_flows(start_url, max_depth=MAX_FLOW_DEPTH, max_flows=MAX_FLOW_COUNT):
-    all_flows = []
+def iter_flows(start_url, max_depth=MAX_FLOW_DEPTH, max_flows=MAX_FLOW_COUNT):
+    """Yield flows (lists of URLs) one at a time, so callers can stream them without holding them all."""
     start = normalize_url(start_url, start_url)
     if not start:
-        return []
+        return
 
-    stack = [(start, [start])]
+    # one shared path, grown and shrunk in place (backtracking); copied only when yielded
+    path = []
+    in_path = set()
     seen_count = 0
+    flow_count = 0
+
+    def dfs(current):
+        nonlocal seen_count, flow_count
+        path.append(current)
+        in_path.add(current)
 
-    while stack and len(all_flows) < max_flows:
-        current, path = stack.pop()
+        neighbors = site_graph.get(current)
         # If no outgoing or reached depth limit -> save path
-        if len(path) - 1 >= max_depth or not site_graph.get(current):
-            all_flows.append(path)
-            continue
-
-        # Expand neighbors
-        neighbors = list(site_graph.get(current, []))
-        # Sort neighbors for determinism (optional)
-        neighbors.sort()
-        for n in neighbors:
-            if n in path:
-                # avoid cycles
-                continue
-            new_path = path + [n]
-            stack.append((n, new_path))
-
-        seen_count += 1
-        if seen_count > (max_flows * 10):
-            # guard against infinite expansion
-            break
+        if len(path) - 1 >= max_depth or not neighbors:
+            flow_count += 1
+            yield path.copy()
+        else:
+            seen_count += 1
+            # reverse-sorted so flows come out in the same order as the old explicit stack
+            for n in sorted(neighbors, reverse=True):
+                if flow_count >= max_flows or seen_count > (max_flows * 10):
+                    # guard against infinite expansion
+                    break
+                if n in in_path:
+                    # avoid cycles
+                    continue
+                yield from dfs(n)
 
-    return all_flows
+        path.pop()
+        in_path.discard(current)
+
+    yield from dfs(start)
+
+
+def generate_flows(start_url, max_depth=MAX_FLOW_DEPTH, max_flows=MAX_FLOW_COUNT):
+    return list(iter_flows(start_url, max_depth=max_depth, max_flows=max_flows))
 
 
 # -------------------------
@@ -459,7 +720,7 @@ def generate_flows(start_url, max_depth=MAX_FLOW_DEPTH, max_flows=MAX_FLOW_COUNT
 # -------------------------
 def export_csvs_and_json():
     # CTA CSV
-    with open(OUTPUT_CSV_CTA, "w", newline="", encoding="utf-8") as f:
+    with open(OUTPUT_CSV_CTA, "w", newline="", encoding="utf-8", buffering=CSV_WRITE_BUFFER) as f:
         writer = csv.DictWriter(f, fieldnames=[
             "page_url", "page_name", "element_type", "text",
             "id_or_class", "link", "screenshot_local", "screenshot_url"
@@ -468,7 +729,7 @@ def export_csvs_and_json():
         writer.writerows([item for item in all_ctas if "element_type" in item])
 
     # Forms CSV
-    with open(OUTPUT_CSV_FORM, "w", newline="", encoding="utf-8") as f:
+    with open(OUTPUT_CSV_FORM, "w", newline="", encoding="utf-8", buffering=CSV_WRITE_BUFFER) as f:
         writer = csv.DictWriter(f, fieldnames=[
             "page_url", "page_name", "form_id_or_class", "method",
             "action", "inputs", "submit_buttons", "form_screenshot_local", "form_screenshot_url"
@@ -478,48 +739,69 @@ def export_csvs_and_json():
 
     # Combined JSON
     try:
-        with open(OUTPUT_JSON, "w", encoding="utf-8") as f:
-            json.dump({"ctas": all_ctas, "forms": all_forms}, f, indent=4, ensure_ascii=False)
+        if orjson is not None:
+            with open(OUTPUT_JSON, "wb") as f:
+                f.write(orjson.dumps({"ctas": all_ctas, "forms": all_forms}, option=orjson.OPT_INDENT_2))
+        else:
+            with open(OUTPUT_JSON, "w", encoding="utf-8") as f:
+                json.dump({"ctas": all_ctas, "forms": all_forms}, f, indent=2, ensure_ascii=False)
     except Exception as e:
         print("⚠ Error writing JSON:", e)
 
     print("✅ CSV & JSON exports done.")
 
 
+# SDR sheet columns: (header, key in the CTA dict); blank keys are left for the analyst to fill in
+SDR_COLUMNS = [
+    ("Page URL", "page_url"),
+    ("Page Name", "page_name"),
+    ("CTA Text", "text"),
+    ("Element Type", "element_type"),
+    ("ID / Class", "id_or_class"),
+    ("Destination Link", "link"),
+    ("Screenshot (Web URL)", "screenshot_url"),
+    ("Tracking Variable (eVar/prop)", None),
+    ("Event (eventX)", None),
+    ("Data Layer Trigger?", None),
+    ("Notes", None),
+]
+
+
 def export_sdr_excel():
-    sdr_rows = []
-    for item in all_ctas:
-        sdr_rows.append({
-            "Page URL": item.get("page_url", ""),
-            "Page Name": item.get("page_name", ""),
-            "CTA Text": item.get("text", ""),
-            "Element Type": item.get("element_type", ""),
-            "ID / Class": item.get("id_or_class", ""),
-            "Destination Link": item.get("link", ""),
-            "Screenshot (Web URL)": item.get("screenshot_url", ""),
-            "Tracking Variable (eVar/prop)": "",
-            "Event (eventX)": "",
-            "Data Layer Trigger?": "",
-            "Notes": ""
-        })
-    df = pd.DataFrame(sdr_rows)
+    # imported here so the Flask worker doesn't pay for openpyxl until an export runs
+    from openpyxl import Workbook
+
     try:
-        # use openpyxl engine to avoid xlsxwriter hyperlink warnings
-        df.to_excel(OUTPUT_EXCEL, index=False, engine="openpyxl")
+        # write-only workbook streams rows to disk instead of holding the sheet in memory
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Sheet1")
+        ws.append([header for header, _ in SDR_COLUMNS])
+        for item in all_ctas:
+            ws.append([item.get(key, "") if key else "" for _, key in SDR_COLUMNS])
+        wb.save(OUTPUT_EXCEL)
         print(f"✅ SDR Excel saved: {OUTPUT_EXCEL}")
     except Exception as e:
         print("⚠ Error writing SDR Excel:", e)
 
 
 def export_flows_excel(flows):
-    # write flows as plain text (joined with arrow) to avoid Excel hyperlink detection
-    text_flows = [{"User Flow": " → ".join(flow)} for flow in flows]
-    df = pd.DataFrame(text_flows)
+    """Write flows (any iterable, e.g. iter_flows) row by row; returns how many were written."""
+    from openpyxl import Workbook
+
+    count = 0
     try:
-        df.to_excel(OUTPUT_FLOWS, index=False, engine="openpyxl")
-        print(f"✅ User flows saved: {OUTPUT_FLOWS} (count={len(flows)})")
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Sheet1")
+        ws.append(["User Flow"])
+        # write flows as plain text (joined with arrow) to avoid Excel hyperlink detection
+        for flow in flows:
+            ws.append([" → ".join(flow)])
+            count += 1
+        wb.save(OUTPUT_FLOWS)
+        print(f"✅ User flows saved: {OUTPUT_FLOWS} (count={count})")
     except Exception as e:
         print("⚠ Error writing flows Excel:", e)
+    return count
 
 
 # ✅ Updated main() — supports live UI status + keeps your logic
@@ -555,9 +837,8 @@ async def main(start_url=START_URL,
     export_csvs_and_json()
     export_sdr_excel()
 
-    # generate flows (may be large) — capped
-    flows = generate_flows(start_url, max_depth=max_flow_depth, max_flows=max_flows)
-    export_flows_excel(flows)
+    # generate flows (may be large) — capped, streamed straight into the sheet
+    flow_count = export_flows_excel(iter_flows(start_url, max_depth=max_flow_depth, max_flows=max_flows))
     # ✅ Zip all screenshots for user download
     zip_public_screenshots()
 
@@ -567,20 +848,23 @@ async def main(start_url=START_URL,
         "pages_crawled": len(visited),
         "ctas_found": len(all_ctas),
         "forms_found": len(all_forms),
-        "flows_generated": len(flows)
+        "flows_generated": flow_count
     }
 
 
 # -------------------------
-import shutil
-
 def zip_public_screenshots():
-    zip_path = os.path.join("public", "screenshots")  # output → public/screenshots.zip
+    zip_path = os.path.join("public", "screenshots.zip")
 
     # Create a zip only if screenshots exist
     if os.path.exists(PUBLIC_SCREENSHOT_DIR) and os.listdir(PUBLIC_SCREENSHOT_DIR):
-        shutil.make_archive(zip_path, 'zip', PUBLIC_SCREENSHOT_DIR)
-        print("✅ Public screenshots zipped successfully:", zip_path + ".zip")
+        # PNGs are already compressed, so store them as-is instead of deflating
+        with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+            for name in sorted(os.listdir(PUBLIC_SCREENSHOT_DIR)):
+                full_path = os.path.join(PUBLIC_SCREENSHOT_DIR, name)
+                if os.path.isfile(full_path):
+                    zf.write(full_path, arcname=name)
+        print("✅ Public screenshots zipped successfully:", zip_path)
     else:
         print("⚠ No screenshots found to zip.")
 